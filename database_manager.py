@@ -1,6 +1,8 @@
+import gc
 import os
-import psycopg2
+from contextlib import contextmanager
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
@@ -8,6 +10,38 @@ from dotenv import load_dotenv
 # Load environment variables from .env file for local development
 load_dotenv()
 
+# Connections kept open in the pool. psycopg2's pool only keeps minconn
+# connections idle and closes any extra ones when they are returned, so
+# minconn and maxconn are both set to this to keep connections reused.
+POOL_SIZE = 5
+
+# Schema migrations, applied once each in order; a migration's version is
+# its position in this list (starting at 1). Statements must be idempotent
+# since concurrent startups may both run a pending migration.
+SCHEMA_MIGRATIONS = [
+    # 1: columns that might not exist in older versions, plus the index
+    # backing the newest-first ordering in load_pins
+    [
+        """
+        ALTER TABLE chocolate_pins
+        ADD COLUMN IF NOT EXISTS is_multi_pack BOOLEAN DEFAULT FALSE
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS ix_pins_created_at
+        ON chocolate_pins (created_at DESC)
+        """,
+    ],
+    # 2: store numbers as floats so rows come back without Decimal objects
+    [
+        """
+        ALTER TABLE chocolate_pins
+        ALTER COLUMN price TYPE DOUBLE PRECISION USING price::double precision,
+        ALTER COLUMN lat TYPE DOUBLE PRECISION USING lat::double precision,
+        ALTER COLUMN lon TYPE DOUBLE PRECISION USING lon::double precision
+        """,
+    ],
+]
+
 class DatabaseManager:
     """
     Manages PostgreSQL database operations for chocolate price pins.
@@ -16,12 +50,13 @@ class DatabaseManager:
     """
     
     def __init__(self):
-        self.connection = None
+        self.pool = None
+        self._prepared = set()
         self.use_database = self._init_database()
     
     def _init_database(self) -> bool:
         """
-        Initialize database connection.
+        Initialize the database connection pool.
         
         Returns:
             bool: True if database connection successful, False otherwise
@@ -35,9 +70,9 @@ class DatabaseManager:
                 print("No DATABASE_URL found in environment")
                 return False
             
-            # Connect to database
-            self.connection = psycopg2.connect(database_url)
-            self.connection.autocommit = True
+            # Replace any existing pool (e.g. when reconnecting)
+            self._close_pool()
+            self.pool = ThreadedConnectionPool(minconn=POOL_SIZE, maxconn=POOL_SIZE, dsn=database_url)
             
             # Create table if it doesn't exist
             self._create_table()
@@ -57,10 +92,10 @@ class DatabaseManager:
             bool: True if connection is working, False otherwise
         """
         try:
-            if not self.connection or self.connection.closed:
+            if not self.pool or self.pool.closed:
                 return False
             
-            with self.connection.cursor() as cursor:
+            with self._conn() as conn, conn.cursor() as cursor:
                 cursor.execute("SELECT 1")
                 return True
                 
@@ -68,69 +103,146 @@ class DatabaseManager:
             print(f"Database connection test failed: {e}")
             return False
     
+    @contextmanager
+    def _conn(self, prepare: bool = True):
+        """
+        Check a connection out of the pool for the duration of a block.
+        
+        Args:
+            prepare: Whether the connection needs the prepared statements
+            
+        Yields:
+            connection: A pooled connection in autocommit mode
+        """
+        conn = self.pool.getconn()
+        try:
+            conn.autocommit = True
+            if prepare and conn not in self._prepared:
+                self._prepare_statements(conn)
+                self._prepared.add(conn)
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn, close=bool(conn.closed))
+            # putconn may itself close the connection, so check afterwards
+            if conn.closed:
+                self._prepared.discard(conn)
+    
+    def _close_pool(self):
+        """Close every pooled connection, if a pool exists"""
+        if self.pool and not self.pool.closed:
+            self.pool.closeall()
+        self._prepared.clear()
+    
     def _create_table(self):
         """Create the pins table if it doesn't exist and ensure all columns are
         present"""
         try:
-            with self.connection.cursor() as cursor:
+            # Statements are prepared against the table, so skip them here
+            with self._conn(prepare=False) as conn, conn.cursor() as cursor:
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS chocolate_pins (
                         id SERIAL PRIMARY KEY,
-                        price DECIMAL(10, 2) NOT NULL,
+                        price DOUBLE PRECISION NOT NULL,
                         location VARCHAR(255) NOT NULL,
                         brand VARCHAR(255),
                         fact TEXT,
-                        lat DECIMAL(10, 8) NOT NULL,
-                        lon DECIMAL(11, 8) NOT NULL,
+                        lat DOUBLE PRECISION NOT NULL,
+                        lon DOUBLE PRECISION NOT NULL,
                         is_multi_pack BOOLEAN DEFAULT FALSE,
                         timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 """)
                 
-                # Add columns that might not exist in older versions
+                # Run only the migrations this database hasn't seen yet,
+                # rather than re-issuing the ALTERs on every startup
                 cursor.execute("""
-                    ALTER TABLE chocolate_pins 
-                    ADD COLUMN IF NOT EXISTS is_multi_pack BOOLEAN DEFAULT FALSE
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        v INT PRIMARY KEY
+                    )
                 """)
+                cursor.execute("SELECT COALESCE(MAX(v), 0) FROM schema_version")
+                (version,) = cursor.fetchone()
+                
+                for v, statements in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+                    for statement in statements:
+                        cursor.execute(statement)
+                    cursor.execute(
+                        "INSERT INTO schema_version (v) VALUES (%s) ON CONFLICT DO NOTHING",
+                        (v,)
+                    )
+                    print(f"Applied schema migration {v}")
                 
                 print("Table 'chocolate_pins' created or verified with all columns")
         except Exception as e:
             print(f"Error creating table: {e}")
             raise
     
-    def load_pins(self) -> List[Dict[str, Any]]:
+    def _prepare_statements(self, conn):
+        """Prepare the write statements once per connection so add_pin and
+        delete_pin skip the per-call parse/plan"""
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                PREPARE add_pin_stmt (double precision, varchar, varchar, text, double precision, double precision, boolean) AS
+                INSERT INTO chocolate_pins (price, location, brand, fact, lat, lon, is_multi_pack)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+            """)
+            cursor.execute("""
+                PREPARE delete_pin_stmt (integer) AS
+                DELETE FROM chocolate_pins WHERE id = $1
+            """)
+    
+    def load_pins(self, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
         """
-        Load all pins from database.
+        Load pins from database, newest first.
+        
+        Args:
+            limit: Maximum number of pins to return (None for all)
+            offset: Number of pins to skip
         
         Returns:
             List[Dict]: List of pin dictionaries
         """
         try:
-            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            # Named (server-side) cursor streams rows in itersize batches
+            # instead of materializing the whole result client-side.
+            # WITH HOLD is required for named cursors under autocommit.
+            with self._conn() as conn, conn.cursor(name='load_pins_cur',
+                                                   cursor_factory=RealDictCursor,
+                                                   withhold=True) as cursor:
+                cursor.itersize = 1000
+                
                 cursor.execute("""
-                    SELECT id, price, location, brand, fact, lat, lon, is_multi_pack,
+                    SELECT id, price, location, brand, fact, lat, lon,
+                           COALESCE(is_multi_pack, FALSE) AS is_multi_pack,
                            TO_CHAR(timestamp, 'YYYY-MM-DD HH24:MI:SS') as timestamp
                     FROM chocolate_pins 
                     ORDER BY created_at DESC
-                """)
+                    LIMIT %s OFFSET %s
+                """, (limit, offset))
                 
-                rows = cursor.fetchall()
-                
-                # Convert to list of dictionaries
+                # Fetch a batch at a time, pausing cyclic GC only while each
+                # batch's dicts are built (they cannot form cycles) so the
+                # pause never spans a network round trip
                 pins = []
-                for row in rows:
-                    pin = dict(row)
-                    # Convert Decimal to float for JSON serialization
-                    pin['price'] = float(pin['price'])
-                    pin['lat'] = float(pin['lat'])
-                    pin['lon'] = float(pin['lon'])
-                    # Ensure is_multi_pack has a default value
-                    if pin.get('is_multi_pack') is None:
-                        pin['is_multi_pack'] = False
-                    pins.append(pin)
+                while True:
+                    rows = cursor.fetchmany(cursor.itersize)
+                    if not rows:
+                        break
+                    
+                    gc_was_enabled = gc.isenabled()
+                    gc.disable()
+                    try:
+                        pins.extend(dict(row) for row in rows)
+                    finally:
+                        if gc_was_enabled:
+                            gc.enable()
                 
-                return pins
+            return pins
                 
         except Exception as e:
             raise Exception(f"Error loading pins from database: {e}")
@@ -153,16 +265,16 @@ class DatabaseManager:
         """
         
         try:
-            with self.connection.cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO chocolate_pins (price, location, brand, fact, lat, lon, is_multi_pack)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """, (price, location, brand, fact, lat, lon, is_multi_pack))
+            with self._conn() as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    "EXECUTE add_pin_stmt (%s, %s, %s, %s, %s, %s, %s)",
+                    (price, location, brand, fact, lat, lon, is_multi_pack)
+                )
                 return True
                 
         except Exception as e:
             print(f"Error adding pin to database: {e}")
-            print(f"Database connection status: {self.connection.closed if self.connection else 'No connection'}")
+            print(f"Database pool status: {'Closed' if not self.pool or self.pool.closed else 'Open'}")
             return False
 
     def delete_pin(self, pin_id: int) -> bool:
@@ -176,8 +288,8 @@ class DatabaseManager:
             bool: True if successful, False otherwise
         """
         try:
-            with self.connection.cursor() as cursor:
-                cursor.execute("DELETE FROM chocolate_pins WHERE id = %s", (pin_id,))
+            with self._conn() as conn, conn.cursor() as cursor:
+                cursor.execute("EXECUTE delete_pin_stmt (%s)", (pin_id,))
                 return cursor.rowcount > 0
                 
         except Exception as e:
@@ -192,7 +304,7 @@ class DatabaseManager:
             bool: True if successful, False otherwise
         """
         try:
-            with self.connection.cursor() as cursor:
+            with self._conn() as conn, conn.cursor() as cursor:
                 cursor.execute("DELETE FROM chocolate_pins")
                 return True
                 
@@ -208,7 +320,7 @@ class DatabaseManager:
             int: Number of pins
         """
         try:
-            with self.connection.cursor() as cursor:
+            with self._conn() as conn, conn.cursor() as cursor:
                 cursor.execute("SELECT COUNT(*) FROM chocolate_pins")
                 return cursor.fetchone()[0]
                 
@@ -225,22 +337,19 @@ class DatabaseManager:
         """        
         try:
             # Check connection status
-            if not self.connection or self.connection.closed:
+            if not self.pool or self.pool.closed:
                 return {
                     'storage_type': 'PostgreSQL Database (Disconnected)',
                     'database_url': os.getenv('DATABASE_URL', 'Not set'),
                     'connection_status': 'Disconnected',
-                    'error': 'Database connection is closed',
+                    'error': 'Database connection pool is closed',
                     'pin_count': 0
                 }
             
-            with self.connection.cursor() as cursor:
+            with self._conn() as conn, conn.cursor() as cursor:
+                # A successful count doubles as the connection health check
                 cursor.execute("SELECT COUNT(*) FROM chocolate_pins")
-                pin_count = cursor.fetchone()[0]
-                
-                # Test connection with a simple query
-                cursor.execute("SELECT 1")
-                cursor.fetchone()
+                (pin_count,) = cursor.fetchone()
                 
                 return {
                     'storage_type': 'PostgreSQL Database',
@@ -260,12 +369,23 @@ class DatabaseManager:
             }
     
     def __del__(self):
-        """Close database connection when object is destroyed"""
-        if self.connection:
-            try:
-                self.connection.close()
-            except:
-                pass
+        """Close pooled connections when object is destroyed"""
+        try:
+            self._close_pool()
+        except:
+            pass
+
+# Shared instance, created on first use rather than at import time
+_instance: Optional[DatabaseManager] = None
 
-# Create a global instance
-database_manager = DatabaseManager()
+def get_database_manager() -> DatabaseManager:
+    """
+    Get the shared DatabaseManager, connecting on the first call.
+    
+    Returns:
+        DatabaseManager: The process-wide database manager
+    """
+    global _instance
+    if _instance is None:
+        _instance = DatabaseManager()
+    return _instance
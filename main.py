@@ -1,9 +1,11 @@
 import streamlit as st
+import streamlit.components.v1 as components
+import numpy as np
 import folium
 from streamlit_folium import st_folium
 import os
 from datetime import datetime
-from database_manager import database_manager
+from operator import itemgetter
 
 # Set page config
 st.set_page_config(
@@ -12,21 +14,91 @@ st.set_page_config(
     layout="wide"
 )
 
+# Map popup markup, filled in per pin by build_popup_html
+POPUP_TEMPLATE = """
+        <div style="width: 250px;">
+            <h4 style="color: #2E86AB; margin-bottom: 10px;">{location}</h4>
+            <p style="margin-bottom: 8px; font-size: 18px; font-weight: bold; color: #D2691E;">
+                💰 £{price:.2f}
+            </p>
+            {fact_block}
+            <p style="margin-bottom: 8px;"><strong>Added:</strong> {timestamp}</p>
+            <p style="margin: 0;"><strong>Location:</strong> {lat:.4f}, {lon:.4f}</p>
+            <p style="margin: 0;"> <strong>{pack_label}</strong></p>
+        </div>
+        """
+FACT_TEMPLATE = '<p style="margin-bottom: 8px;"><strong>Notes:</strong></p><p style="margin-bottom: 8px;">{fact}</p>'
+
+# Sidebar sort orders, mapped to whether they sort descending
+SORT_ORDERS = {"price": False, "timestamp": True}
+
 # Data management functions using the persistent database manager
+@st.cache_resource(show_spinner=False)
+def get_db():
+    """Get the database manager, created once per process and shared by all
+    reruns and sessions"""
+    from database_manager import get_database_manager
+    return get_database_manager()
+
+@st.cache_data(show_spinner=False)
 def load_pins():
-    """Load pins using the database manager"""
-    return database_manager.load_pins()
+    """Load pins using the database manager, cached per process so new
+    sessions don't re-query; cleared whenever pins are written"""
+    pins = get_db().load_pins()
+    for pin in pins:
+        pin['popup_html'] = build_popup_html(pin)
+    return pins
+
+def build_popup_html(pin):
+    """Build the map popup HTML for a pin"""
+    fact_block = FACT_TEMPLATE.format(fact=pin['fact']) if pin.get('fact') else ''
+    pack_label = "Multi-Pack" if pin.get('is_multi_pack') else "Single Bar"
+    return POPUP_TEMPLATE.format_map({**pin, 'fact_block': fact_block, 'pack_label': pack_label})
+
+def set_pins(pins):
+    """Store pins in session state along with the sidebar's grouped, sorted
+    views, so sorting happens once per data change rather than every rerun"""
+    st.session_state.pins = pins
+    groups = {
+        "Single bars": [pin for pin in pins if not pin.get('is_multi_pack')],
+        "Multi-pack bars": [pin for pin in pins if pin.get('is_multi_pack')]
+    }
+    st.session_state.sorted_pins = {
+        order: {
+            label: sorted(group, key=itemgetter(order), reverse=reverse)
+            for label, group in groups.items()
+        }
+        for order, reverse in SORT_ORDERS.items()
+    }
 
 def save_pin(price, location, brand, fact, lat, lon, is_multi_pack):
     """Save a new pin using the database manager"""
     try:
-        return database_manager.add_pin(price, location, brand, fact, lat, lon, is_multi_pack)
+        saved = get_db().add_pin(price, location, brand, fact, lat, lon, is_multi_pack)
+        if saved:
+            load_pins.clear()
+        return saved
     except Exception as e:
         print(f"Error in save_pin: {e}")
         return False
 
+@st.cache_data(show_spinner=False, max_entries=4)
+def build_pin_features(pins):
+    """Build the GeoJSON features for the pins, cached on the pin contents so
+    reruns that don't change the pins skip the per-pin work"""
+    return [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [pin['lon'], pin['lat']]},
+            "properties": {"popup": pin['popup_html'], "tooltip": str(pin['price'])}
+        }
+        for pin in pins
+    ]
+
 def create_map(pins, center_lat, center_lon):
-    """Create a folium map with existing pins"""
+    """Create a folium map with existing pins. A fresh Map is built on every
+    call: rendering mutates it, so it must not be shared between reruns or
+    sessions"""
 
     m = folium.Map(
         location=[center_lat, center_lon],
@@ -34,58 +106,182 @@ def create_map(pins, center_lat, center_lon):
         tiles="OpenStreetMap"
     )
     
-    # Add existing pins to the map
-    for pin in pins:
-        popup_html = f"""
-        <div style="width: 250px;">
-            <h4 style="color: #2E86AB; margin-bottom: 10px;">{pin['location']}</h4>
-            <p style="margin-bottom: 8px; font-size: 18px; font-weight: bold; color: #D2691E;">
-                💰 £{pin.get('price', 'N/A'):.2f}
-            </p>
-            {f'<p style="margin-bottom: 8px;"><strong>Notes:</strong></p><p style="margin-bottom: 8px;">{pin["fact"]}</p>' if pin.get('fact') else ''}
-            <p style="margin-bottom: 8px;"><strong>Added:</strong> {pin['timestamp']}</p>
-            <p style="margin: 0;"><strong>Location:</strong> {pin['lat']:.4f}, {pin['lon']:.4f}</p>
-            <p style="margin: 0;"> {"<strong>Multi-Pack</strong>"if pin.get('is_multi_pack') else "<strong>Single Bar</strong>"}</p>
-        </div>
-        """
-        
-        folium.Marker(
-            location=[pin['lat'], pin['lon']],
-            popup=folium.Popup(popup_html, max_width=300),
-            tooltip=pin['price'],
-            icon=folium.Icon(color='purple', icon='info-sign')
+    features = build_pin_features(pins)
+    
+    # Add all pins as a single GeoJSON layer rather than one Leaflet layer
+    # per marker, which keeps large pin sets responsive in the browser
+    if features:
+        folium.GeoJson(
+            {"type": "FeatureCollection", "features": features},
+            # Keep pin clicks from bubbling to the map, where placement mode
+            # would treat them as a new location
+            marker=folium.CircleMarker(
+                radius=6, color='purple', fill=True, fill_opacity=0.9,
+                bubbling_mouse_events=False
+            ),
+            popup=folium.GeoJsonPopup(fields=["popup"], labels=False, max_width=300),
+            tooltip=folium.GeoJsonTooltip(fields=["tooltip"], labels=False)
         ).add_to(m)
     
     return m
 
+@st.cache_data(show_spinner=False, max_entries=4)
+def render_map_html(pins, center_lat, center_lon):
+    """Render the map to a self-contained HTML page for read-only display,
+    cached on the pin contents so the browser gets identical markup"""
+    return create_map(pins, center_lat, center_lon).get_root().render()
+
+@st.fragment
+def render_map_and_form(center_lat, center_lon):
+    """Render the map and add-pin form as a fragment, so map clicks and form
+    input rerun only this section rather than the whole page"""
+    col1, col2 = st.columns([1, 3])
+    
+    with col2:
+        if st.session_state.placement_mode:
+            # Display the interactive map and capture click events
+            m = create_map(st.session_state.pins, center_lat, center_lon)
+            map_data = st_folium(
+                m,
+                width=800,
+                height=600,
+                returned_objects=["last_clicked"],
+                key="map"
+            )
+            
+            # Handle map clicks, only touching state for a new location
+            if map_data['last_clicked'] is not None:
+                new_location = (map_data['last_clicked']['lat'], map_data['last_clicked']['lng'])
+                if st.session_state.selected_location != new_location:
+                    st.session_state.selected_location = new_location
+                    st.session_state.show_form = True
+        else:
+            # Read-only view: static pre-rendered HTML, no click round-trips
+            components.html(
+                render_map_html(st.session_state.pins, center_lat, center_lon),
+                width=800,
+                height=600
+            )
+    
+    with col1:
+        # Form for adding new pins
+        if st.session_state.show_form and st.session_state.selected_location:
+            st.subheader("💰 Add Price Entry")
+            
+            lat, lon = st.session_state.selected_location
+            st.write(f"**Selected Location:**")
+            st.write(f"Latitude: {lat:.4f}")
+            st.write(f"Longitude: {lon:.4f}")
+            
+            with st.form("pin_form"):
+                price = st.number_input(
+                    "Price per chocolate bar (£)",
+                    min_value=0.0,
+                    max_value=10.0,
+                    value=0.0,
+                    step=0.01,
+                    format="%.2f"
+                )
+
+                location = st.text_input(
+                    "Location/Store Name",
+                    placeholder="e.g., Local Chocolate Shop, Supermarket Name..."
+                )
+
+                brand = st.radio(
+                    "The type of chocolate",
+                    ["Cadbury Orange Twirl", "Off-brand orange twirl"]
+                )
+                
+                fact = ""
+                if brand == "Off-brand orange twirl":
+                    fact = st.text_area(
+                        "Name of alternative brand",
+                        placeholder="e.g., Brand ...",
+                        height=100
+                    )
+                
+                # Checkbox for marking good deals
+                is_multi_pack = st.checkbox("Part of a multi-pack", value=False)
+                
+                submit_col1, submit_col2 = st.columns(2)
+                
+                with submit_col1:
+                    submitted = st.form_submit_button("📍 Add Pin", use_container_width=True)
+                
+                with submit_col2:
+                    cancelled = st.form_submit_button("❌ Cancel", use_container_width=True)
+                
+                if submitted and location and price > 0:
+                    if save_pin(price, location, brand, fact, lat, lon, is_multi_pack):
+                        st.success("Pin added successfully!")
+                        set_pins(load_pins())  # Refresh from storage
+                        st.session_state.show_form = False
+                        st.session_state.selected_location = None
+                        st.session_state.placement_mode = False
+                        st.rerun()
+                    else:
+                        st.error("Failed to save pin. Please try again.")
+
+                elif submitted and (not location or price <= 0):
+                    if not location:
+                        st.error("Please enter a location/store name.")
+                    if price <= 0:
+                        st.error("Please enter a valid price greater than £0.")
+                
+                if cancelled:
+                    st.session_state.show_form = False
+                    st.session_state.selected_location = None
+                    st.session_state.placement_mode = False
+                    st.rerun(scope="fragment")
+        
+        elif st.session_state.placement_mode:
+            st.info("👆 Click anywhere on the map to add a chocolate price entry!")
+            if st.button("❌ Stop Placing", use_container_width=True):
+                st.session_state.placement_mode = False
+                st.rerun(scope="fragment")
+        
+        else:
+            if st.button("📍 Place New Pin", use_container_width=True):
+                st.session_state.placement_mode = True
+                st.rerun(scope="fragment")
+
 def main():
+    db = get_db()
+    
     st.title("🍫 Orange Twirl Price Map")
-    st.markdown("Click on the map to add pins for chocolate prices!")
+    st.markdown("Click **Place New Pin**, then click on the map to add pins for chocolate prices!")
     
     # Initialize session state
     if 'pins' not in st.session_state:
-        st.session_state.pins = load_pins()
+        set_pins(load_pins())
     
     if 'show_form' not in st.session_state:
         st.session_state.show_form = False
     
     if 'selected_location' not in st.session_state:
         st.session_state.selected_location = None
+    
+    if 'placement_mode' not in st.session_state:
+        st.session_state.placement_mode = False
 
     # Price statistics
     if st.session_state.pins:
-        prices = [pin.get('price', 0) for pin in st.session_state.pins if pin.get('price', 0) > 0]
-        if prices:
+        prices = np.fromiter(
+            (price for pin in st.session_state.pins if (price := pin.get('price', 0)) > 0),
+            dtype=np.float64
+        )
+        if prices.size:
             st.markdown("### 📊 Price Statistics")
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("Lowest Price", f"£{min(prices):.2f}")
+                st.metric("Lowest Price", f"£{prices.min():.2f}")
             with col2:
-                st.metric("Highest Price", f"£{max(prices):.2f}")
+                st.metric("Highest Price", f"£{prices.max():.2f}")
             with col3:
-                st.metric("Average Price", f"£{sum(prices)/len(prices):.2f}")
+                st.metric("Average Price", f"£{prices.mean():.2f}")
             with col4:
-                st.metric("Total Locations", len(prices))
+                st.metric("Total Locations", prices.size)
     
     # Sidebar for controls and pin list
     with st.sidebar:
@@ -101,14 +297,11 @@ def main():
         if st.session_state.pins:
             order = st.radio(
                     "Order by:",
-                    ["price", "timestamp"],
+                    list(SORT_ORDERS),
                 )
-            reverse_dict = {"price": False, "timestamp": True}
-            single_pins = [pin for pin in st.session_state.pins if not pin.get('is_multi_pack')]
-            multi_back_pins = [pin for pin in st.session_state.pins if pin.get('is_multi_pack')]
-            for label, pins in {"Single bars": single_pins, "Multi-pack bars": multi_back_pins}.items():
+            for label, pins in st.session_state.sorted_pins[order].items():
                 st.subheader(label)
-                for i, pin in enumerate(sorted(pins, key=lambda x: x[order], reverse=reverse_dict[order])):
+                for i, pin in enumerate(pins):
                     price_display = f"£{pin.get('price', 0):.2f}" if 'price' in pin else "No price"
                     with st.expander(f"{pin['location']} - {price_display}", expanded=False):
                         if 'price' in pin:
@@ -119,22 +312,20 @@ def main():
                         st.write(f"**Added:** {pin['timestamp']}")
 
                         if st.button(f"Delete {label.lower()} pin {i+1}", key=f"delete_{label.lower()}{i}"):
-                            # For database: use the pin's actual ID
-                            # For JSON: need to find the original index in the unsorted list
-                            if database_manager.use_database:
-                                pin_id = pin.get('id')
-                                if pin_id and database_manager.delete_pin(pin_id):
-                                    st.session_state.pins = load_pins()  # Refresh from storage
-                                    st.rerun()
-                                else:
-                                    st.error("Failed to delete pin")
+                            pin_id = pin.get('id')
+                            if db.use_database and pin_id and db.delete_pin(pin_id):
+                                load_pins.clear()
+                                set_pins(load_pins())  # Refresh from storage
+                                st.rerun()
+                            else:
+                                st.error("Failed to delete pin")
         else:
-            st.info("No chocolate prices added yet. Click on the map to add your first price entry!")
+            st.info("No chocolate prices added yet. Click **Place New Pin**, then click on the map to add your first price entry!")
         
         # Data storage info (for debugging/transparency)
         st.subheader(f"📁 Data Storage Info")
         with st.expander("📁 Storage Info", expanded=False):
-            info = database_manager.get_data_info()
+            info = db.get_data_info()
             st.write(f"**Storage Type:** {info['storage_type']}")
             if 'database_url' in info:
                 st.write(f"**Database:** Connected" if info['connection_status'] == 'Connected' else f"**Database:** {info['connection_status']}")
@@ -146,14 +337,14 @@ def main():
                 col1, col2 = st.columns(2)
                 with col1:
                     if st.button("🔍 Test Connection"):
-                        if database_manager.test_connection():
+                        if db.test_connection():
                             st.success("Database connection is working!")
                         else:
                             st.error("Database connection failed!")
                 
                 with col2:
                     if st.button("🔄 Reconnect"):
-                        if database_manager._init_database():
+                        if db._init_database():
                             st.success("Reconnected successfully!")
                             st.rerun()
                         else:
@@ -170,7 +361,7 @@ def main():
             
             # Only show backup for JSON storage
             if 'data_directory' in info and st.button("📋 Create Backup"):
-                backup_path = database_manager.json_manager.backup_data() if hasattr(database_manager, 'json_manager') else None
+                backup_path = db.json_manager.backup_data() if hasattr(db, 'json_manager') else None
                 if backup_path:
                     st.success(f"Backup created: {os.path.basename(backup_path)}")
                 else:
@@ -178,106 +369,13 @@ def main():
 
     
     # Main map area
-    col1, col2 = st.columns([1, 3])
-    
-    with col2:
-        # Create and display the map
-        m = create_map(st.session_state.pins, center_lat, center_lon)
-        
-        # Display the map and capture click events
-        map_data = st_folium(
-            m,
-            width=800,
-            height=600,
-            returned_objects=["last_object_clicked", "last_clicked"],
-            key="map"
-        )
-        
-        # Handle map clicks
-        if map_data['last_object_clicked'] is None and map_data['last_clicked'] is not None:
-            clicked_lat = map_data['last_clicked']['lat']
-            clicked_lon = map_data['last_clicked']['lng']
-            st.session_state.selected_location = (clicked_lat, clicked_lon)
-            st.session_state.show_form = True
-    
-    with col1:
-        # Form for adding new pins
-        if st.session_state.show_form and st.session_state.selected_location:
-            st.subheader("💰 Add Price Entry")
-            
-            lat, lon = st.session_state.selected_location
-            st.write(f"**Selected Location:**")
-            st.write(f"Latitude: {lat:.4f}")
-            st.write(f"Longitude: {lon:.4f}")
-            
-            with st.form("pin_form"):
-                price = st.number_input(
-                    "Price per chocolate bar (£)",
-                    min_value=0.0,
-                    max_value=10.0,
-                    value=0.0,
-                    step=0.01,
-                    format="%.2f"
-                )
-
-                location = st.text_input(
-                    "Location/Store Name",
-                    placeholder="e.g., Local Chocolate Shop, Supermarket Name..."
-                )
-
-                brand = st.radio(
-                    "The type of chocolate",
-                    ["Cadbury Orange Twirl", "Off-brand orange twirl"]
-                )
-                
-                fact = ""
-                if brand == "Off-brand orange twirl":
-                    fact = st.text_area(
-                        "Name of alternative brand",
-                        placeholder="e.g., Brand ...",
-                        height=100
-                    )
-                
-                # Checkbox for marking good deals
-                is_multi_pack = st.checkbox("Part of a multi-pack", value=False)
-                
-                submit_col1, submit_col2 = st.columns(2)
-                
-                with submit_col1:
-                    submitted = st.form_submit_button("📍 Add Pin", use_container_width=True)
-                
-                with submit_col2:
-                    cancelled = st.form_submit_button("❌ Cancel", use_container_width=True)
-                
-                if submitted and location and price > 0:
-                    if save_pin(price, location, brand, fact, lat, lon, is_multi_pack):
-                        st.success("Pin added successfully!")
-                        st.session_state.pins = load_pins()  # Refresh from storage
-                        st.session_state.show_form = False
-                        st.session_state.selected_location = None
-                        st.rerun()
-                    else:
-                        st.error("Failed to save pin. Please try again.")
-
-                elif submitted and (not location or price <= 0):
-                    if not location:
-                        st.error("Please enter a location/store name.")
-                    if price <= 0:
-                        st.error("Please enter a valid price greater than £0.")
-                
-                if cancelled:
-                    st.session_state.show_form = False
-                    st.session_state.selected_location = None
-                    st.rerun()
-        
-        elif not st.session_state.show_form:
-            st.info("👆 Click anywhere on the map to add a chocolate price entry!")
+    render_map_and_form(center_lat, center_lon)
     
     # Instructions
     st.markdown("---")
     st.markdown("""
     ### 🍫 How to use this chocolate price tracker:
-    1. **Click anywhere on the map** to select a location for your price entry
+    1. **Click "Place New Pin"**, then **click anywhere on the map** to select a location for your price entry
     2. **Fill in the form** with store/location name and chocolate price
     3. **Add notes** (optional) about the chocolate brand, type, size, etc.
     4. **Click "Add Pin"** to save your price to the map